@@ -5,6 +5,7 @@ WINDOW_SIZE = 256
 
 SAMPLING_RATE = 44100
 VAMP_FEATURE_STEP = 2048 / SAMPLING_RATE
+AUDIO_INT16_SCALE = 32768  # audios are stored as int16 PCM, so samples must be divided by this on read
 
 LABEL_PADDING_VALUE = -1
 FEATURE_PADDING_VALUE = 0
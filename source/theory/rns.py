@@ -1,17 +1,25 @@
 import re
-import numpy as np
+
+from functools import lru_cache
 
 from ..utils import get_note_pc, get_note_name
 from ..constants import DEGREE_MAP, MODE_INTERVALS, ACCIDENTAL_MAP, QUALITY_INTERVALS
 
+RN_PATTERN = re.compile(r'^([#b]?)([IViv]{1,3})(.*)$')
+
 
+@lru_cache(maxsize=None)
 def get_scale_pcs(tonic_pc, mode):
-    return np.cumsum([tonic_pc] + MODE_INTERVALS[mode]) % 12
+    pcs = [tonic_pc % 12]
+    for interval in MODE_INTERVALS[mode]:
+        tonic_pc += interval
+        pcs.append(tonic_pc % 12)
+
+    return tuple(pcs)
 
 
 def parse_rn(rn):
-    pattern = r'^([#b]?)([IViv]{1,3})(.*)$'
-    match = re.match(pattern, rn)
+    match = RN_PATTERN.match(rn)
 
     if not match:
         raise ValueError(f'No match for {rn = }')
@@ -27,6 +35,7 @@ def get_chord_quality(degree, extension):
     return major_map[extension] if degree.isupper() else minor_map[extension]
 
 
+@lru_cache(maxsize=None)
 def get_rn_pitch_classes(rn: str, scale: str) -> str:
     """ Example usage:
             get_rn_pitch_classes('I', 'C major') --> '0-4-7'
@@ -51,8 +60,12 @@ def get_rn_pitch_classes(rn: str, scale: str) -> str:
     root_pc = key_scale[DEGREE_MAP[degree.upper()]] + ACCIDENTAL_MAP[accidental]
     intervals = QUALITY_INTERVALS[get_chord_quality(degree, extension)]
 
-    pitch_classes = np.cumsum([root_pc] + intervals) % 12
-    return '-'.join(pitch_classes.astype(str))
+    pitch_classes = [root_pc % 12]
+    for interval in intervals:
+        root_pc += interval
+        pitch_classes.append(root_pc % 12)
+
+    return '-'.join(map(str, pitch_classes))
 
 
 if __name__ == '__main__':
@@ -5,14 +5,15 @@ import os
 import json
 import vamp
 import h5py
-import librosa
+import numba
 import logging
+import hdf5plugin
 import numpy as np
 
-from typing import Tuple
+from typing import Dict, List, Tuple
+from numba import njit, prange
 from multiprocessing.pool import Pool
-from scipy.interpolate import interp1d
-from skimage.util import view_as_windows
+from numpy.lib.stride_tricks import sliding_window_view
 
 from source.utils import has_valid_tags
 from source.constants import (
@@ -20,13 +21,17 @@ from source.constants import (
     WINDOW_SIZE,
     SAMPLING_RATE,
     VAMP_FEATURE_STEP,
+    AUDIO_INT16_SCALE,
     AUDIOS_FILEPATH,
     VAMP_FEATURES_FILEPATH,
     THEORYTAB_DATASET_FILEPATH
 )
 
 NUM_WORKERS = 8
-BATCH_SIZE = 100
+LOG_INTERVAL = 100
+COMPRESSION = hdf5plugin.Blosc(cname='zstd', clevel=3, shuffle=hdf5plugin.Blosc.BITSHUFFLE)
+
+worker_audios_h5f = None  # audios file handle opened by each worker in init_worker
 
 logging.basicConfig(
     level=logging.INFO,
@@ -36,36 +41,54 @@ logging.basicConfig(
 
 
 def minmax(x, axis=0):
-    return (x - x.min(axis=axis)) / (x.max(axis=axis) - x.min(axis=axis) + 1e-8)
+    x_min = x.min(axis=axis, keepdims=True)
+    x_max = x.max(axis=axis, keepdims=True)
+
+    np.subtract(x, x_min, out=x)
+    np.divide(x, x_max - x_min + 1e-8, out=x)
+    return x
 
 
 def standardize(x, axis=0):
-    return (x - x.mean(axis=axis)) / (x.std(axis=axis) + 1e-8)
+    x_mean = x.mean(axis=axis, keepdims=True)
+    x_std = x.std(axis=axis, keepdims=True)
+
+    np.subtract(x, x_mean, out=x)
+    np.divide(x, x_std + 1e-8, out=x)
+    return x
 
 
 def get_beats_to_frames(num_beats: int, num_frames: int):
-    beat_to_time_fn = interp1d((0, num_beats), (0, VAMP_FEATURE_STEP * num_frames), kind='linear', fill_value='extrapolate')
-    time_to_frame_fn = lambda time: librosa.time_to_frames(time, sr=SAMPLING_RATE, hop_length=2048)
-    
-    beats_to_frames = time_to_frame_fn(beat_to_time_fn(np.arange(0, num_beats + 1e-4)))
+    beats_times = np.arange(0, num_beats + 1e-4) * (VAMP_FEATURE_STEP * num_frames / num_beats)
+    beats_to_frames = (beats_times * SAMPLING_RATE).astype(int) // 2048
+
     return beats_to_frames
 
 
+@njit(parallel=True, cache=True)
+def resample_kernel(feature, beats_to_frames, out):
+    feature_size, num_frames = feature.shape
+
+    for i in prange(out.shape[1]):
+        start = min(beats_to_frames[i], num_frames - 1)
+        end = min(beats_to_frames[i + 1], num_frames)
+
+        if start == end:
+            out[:, i] = feature[:, start]
+        else:
+            for j in range(feature_size):
+                total = 0.0
+                for k in range(start, end):
+                    total += feature[j, k]
+
+                out[j, i] = total / (end - start)
+
+
 def resample_feature(feature, beats_to_frames, normalization = None):
-    resampled_frames = []
     num_beats = len(beats_to_frames) - 1
-    
-    for i in range(num_beats):
-        if beats_to_frames[i] == beats_to_frames[i+1]:
-            frame_idx = min(beats_to_frames[i], feature.shape[1] - 1)
-            frame = feature[:, frame_idx]
-        else:
-            frame = np.mean(feature[:, beats_to_frames[i]:beats_to_frames[i+1]], axis=1)
-            
-        resampled_frames.append(frame)
-        
-    resampled_feature = np.stack(resampled_frames, axis=1)
-    assert resampled_feature.shape[1] == num_beats
+
+    resampled_feature = np.empty((feature.shape[0], num_beats), dtype=feature.dtype)
+    resample_kernel(feature, beats_to_frames, resampled_feature)
     
     if normalization is not None:
         resampled_feature = normalization(resampled_feature)
@@ -73,18 +96,25 @@ def resample_feature(feature, beats_to_frames, normalization = None):
     return resampled_feature
 
 
-def compute_feature(audio: np.ndarray, num_beats: int, name: str, chromanormalize: int = 1, **kwargs) -> np.ndarray:
-    _, feature = vamp.collect(
+def collect_features(audio: np.ndarray, outputs: List[str], chromanormalize: int = 1) -> Dict[str, np.ndarray]:
+    frames = {output: [] for output in outputs}
+
+    for feature in vamp.process_audio_multiple_outputs(
         audio,
         sample_rate=SAMPLING_RATE,
         plugin_key='nnls-chroma:nnls-chroma',
-        output=name,
+        outputs=outputs,
         parameters={'chromanormalize': chromanormalize}
-    )['matrix']
+    ):
+        for output, values in feature.items():
+            frames[output].append(values['values'])
+
+    return {output: np.stack(values, axis=1) for output, values in frames.items()}
+
 
-    # For some reason, VAMP is returning the features 3 semitones higher
-    feature = feature.T
-    feature = np.roll(feature, shift=-3, axis=0)
+def compute_feature(feature: np.ndarray, num_beats: int, **kwargs) -> np.ndarray:
+    # For some reason, VAMP is returning the features 3 semitones higher (same as np.roll(feature, -3, axis=0))
+    feature = np.concatenate((feature[3:], feature[:3]), axis=0)
 
     beats_to_frames = get_beats_to_frames(num_beats, feature.shape[1])
     resampled_feature = resample_feature(feature, beats_to_frames, **kwargs)
@@ -93,19 +123,47 @@ def compute_feature(audio: np.ndarray, num_beats: int, name: str, chromanormaliz
 
 
 def get_vamp_features(audio: np.ndarray, num_beats: int) -> Tuple:
-    chroma = compute_feature(audio, num_beats, name='chroma', normalization=minmax)
-    basschroma = compute_feature(audio, num_beats, name='basschroma', normalization=minmax)
-    spectrum = compute_feature(audio, num_beats, name='semitonespectrum', chromanormalize=0, normalization=standardize)
+    features = collect_features(audio, ['chroma', 'basschroma', 'semitonespectrum'], chromanormalize=1)
+
+    chroma = compute_feature(features['chroma'], num_beats, normalization=minmax)
+    basschroma = compute_feature(features['basschroma'], num_beats, normalization=minmax)
+    spectrum = compute_feature(features['semitonespectrum'], num_beats, normalization=standardize)
 
     return chroma, basschroma, spectrum
 
 
-def chunkify_feature(feature: np.ndarray, feature_size: int):
+def init_worker():
+    global worker_audios_h5f
+    worker_audios_h5f = h5py.File(AUDIOS_FILEPATH, 'r')
+
+    # Splitting the available cores between workers avoids oversubscribing them with numba threads
+    numba.set_num_threads(max(1, len(os.sched_getaffinity(0)) // NUM_WORKERS))
+
+    resample_feature(np.zeros((1, 2), dtype=np.float32), np.arange(3))
+
+
+def get_vamp_features_by_id(task: Tuple[str, int]) -> Tuple:
+    theorytab_id, num_beats = task
+
+    try:
+        audio = worker_audios_h5f[theorytab_id][:]
+
+        # Audios stored as int16 PCM are converted back to float32 samples in [-1, 1)
+        if audio.dtype == np.int16:
+            audio = audio.astype(np.float32) / AUDIO_INT16_SCALE
+
+        return theorytab_id, get_vamp_features(audio, num_beats)
+
+    except Exception as err:
+        raise RuntimeError(f'{theorytab_id = }: {type(err).__name__}: {err}') from err
+
+
+def chunkify_feature(feature: np.ndarray):
     if feature.shape[1] < WINDOW_SIZE:
         feature = np.pad(feature, ((0, 0), (0, WINDOW_SIZE - feature.shape[1])))
 
-    windows = view_as_windows(feature, (feature_size, WINDOW_SIZE), (feature_size, STEP_SIZE))
-    windows = windows.squeeze(0)
+    windows = sliding_window_view(feature, WINDOW_SIZE, axis=1)[:, ::STEP_SIZE]
+    windows = np.ascontiguousarray(windows.transpose(1, 0, 2))
 
     return windows
 
@@ -116,7 +174,7 @@ def main():
         valid_theorytab_ids = [theorytab_id for theorytab_id, theorytab in theorytab_dataset.items() if has_valid_tags(theorytab['tags'])]
 
     if not os.path.exists(VAMP_FEATURES_FILEPATH):
-        with h5py.File(VAMP_FEATURES_FILEPATH, 'w'):
+        with h5py.File(VAMP_FEATURES_FILEPATH, 'w', libver='latest'):
             pass
     
     with h5py.File(VAMP_FEATURES_FILEPATH, 'r') as vamp_h5f:
@@ -126,49 +184,39 @@ def main():
         pending_theorytab_ids = [theorytab_id for theorytab_id in valid_theorytab_ids if theorytab_id not in processed_theorytab_ids]
         logging.info(f'Pending theorytab ids: {len(pending_theorytab_ids)}/{len(valid_theorytab_ids)}')
 
-        counter = 0
-        with h5py.File(VAMP_FEATURES_FILEPATH, 'a') as vamp_h5f:
-            for i in range(0, len(pending_theorytab_ids), BATCH_SIZE):
-                try:
-                    batch_theorytab_ids = pending_theorytab_ids[i:i+BATCH_SIZE]
-                    batch_audios = [audios_h5f[theorytab_id][:] for theorytab_id in batch_theorytab_ids]
-                    batch_num_beats = [theorytab_dataset[theorytab_id]['num_beats'] for theorytab_id in batch_theorytab_ids]
-
-                    valid_batch_audios = []
-                    valid_batch_theorytab_ids = []
-                    valid_batch_num_beats = []
-
-                    for theorytab_id, audio, num_beats in zip(batch_theorytab_ids, batch_audios, batch_num_beats):
-                        if librosa.get_duration(y=audio, sr=SAMPLING_RATE) == 0:
-                            logging.warning(f'Skipping {theorytab_id = } due to empty audio')
-                            continue
-
-                        valid_batch_audios.append(audio)
-                        valid_batch_theorytab_ids.append(theorytab_id)
-                        valid_batch_num_beats.append(num_beats)
-
-                    with Pool(NUM_WORKERS) as pool:
-                        results = pool.starmap(get_vamp_features, zip(valid_batch_audios, valid_batch_num_beats))
-
-                    for theorytab_id, (chroma, basschroma, spectrum) in zip(valid_batch_theorytab_ids, results):
-                        chroma_chunks = chunkify_feature(chroma, feature_size=12)
-                        basschroma_chunks = chunkify_feature(basschroma, feature_size=12)
-                        spectrum_chunks = chunkify_feature(spectrum, feature_size=84)
-
-                        assert len(chroma_chunks) == len(basschroma_chunks)
-                        assert len(chroma_chunks) == len(spectrum_chunks)
-
-                        for idx in range(len(chroma_chunks)):
-                            vamp_h5f.create_dataset(f'{theorytab_id}/{idx}/chroma', data=chroma_chunks[idx], compression='gzip')
-                            vamp_h5f.create_dataset(f'{theorytab_id}/{idx}/basschroma', data=basschroma_chunks[idx], compression='gzip')
-                            vamp_h5f.create_dataset(f'{theorytab_id}/{idx}/spectrum', data=spectrum_chunks[idx], compression='gzip')
-                except Exception as err:
-                    logging.error(f'Exception for batch theorytab ids: {valid_batch_theorytab_ids}: {err}')
-                    sys.exit(1)
-
-                counter += len(batch_theorytab_ids)
-                logging.info(f'Processed {counter}/{len(pending_theorytab_ids)} theorytab ids')
+        non_empty_theorytab_ids = []
+        for theorytab_id in pending_theorytab_ids:
+            if audios_h5f[theorytab_id].shape[0] == 0:
+                logging.warning(f'Skipping {theorytab_id = } due to empty audio')
+                continue
+
+            non_empty_theorytab_ids.append(theorytab_id)
+
+    non_empty_theorytab_ids.sort(key=lambda theorytab_id: theorytab_dataset[theorytab_id]['num_beats'], reverse=True)
+    tasks = [(theorytab_id, theorytab_dataset[theorytab_id]['num_beats']) for theorytab_id in non_empty_theorytab_ids]
+
+    with Pool(NUM_WORKERS, initializer=init_worker) as pool, h5py.File(VAMP_FEATURES_FILEPATH, 'a', libver='latest', rdcc_nbytes=64 * 1024**2) as vamp_h5f:
+        try:
+            results = pool.imap_unordered(get_vamp_features_by_id, tasks)
+
+            for counter, (theorytab_id, (chroma, basschroma, spectrum)) in enumerate(results, start=1):
+                chroma_chunks = chunkify_feature(chroma)
+                basschroma_chunks = chunkify_feature(basschroma)
+                spectrum_chunks = chunkify_feature(spectrum)
+
+                assert len(chroma_chunks) == len(basschroma_chunks)
+                assert len(chroma_chunks) == len(spectrum_chunks)
+
+                theorytab_group = vamp_h5f.require_group(theorytab_id)
+                theorytab_group.create_dataset('chroma', data=chroma_chunks, chunks=(1, 12, WINDOW_SIZE), **COMPRESSION)
+                theorytab_group.create_dataset('basschroma', data=basschroma_chunks, chunks=(1, 12, WINDOW_SIZE), **COMPRESSION)
+                theorytab_group.create_dataset('spectrum', data=spectrum_chunks, chunks=(1, 84, WINDOW_SIZE), **COMPRESSION)
 
+                if counter % LOG_INTERVAL == 0 or counter == len(tasks):
+                    logging.info(f'Processed {counter}/{len(tasks)} theorytab ids')
+        except Exception as err:
+            logging.error(f'Exception while extracting VAMP features: {err}')
+            sys.exit(1)
 
 if __name__ == '__main__':
     main()
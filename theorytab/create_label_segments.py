@@ -4,9 +4,10 @@ sys.path.append('..')
 import json
 import h5py
 import logging
+import hdf5plugin
 
 from tqdm import tqdm
-from skimage.util import view_as_windows
+from numpy.lib.stride_tricks import sliding_window_view
 
 from source.utils import has_valid_tags, encode_labels
 from source.constants import (
@@ -17,6 +18,8 @@ from source.constants import (
     THEORYTAB_DATASET_FILEPATH
 )
 
+COMPRESSION = hdf5plugin.Blosc(cname='zstd', clevel=3, shuffle=hdf5plugin.Blosc.BITSHUFFLE)
+
 logging.basicConfig(
     level=logging.INFO,
     format='[%(levelname)s] %(asctime)s - %(message)s',
@@ -28,34 +31,25 @@ def main():
     with open(THEORYTAB_DATASET_FILEPATH, 'r') as fp:
         theorytab_dataset = json.load(fp)
 
-    theorytab_ids_to_keep = set()
     complete_rns = set(TASK_DOMAINS['complete_rn'])
+    filtered_theorytab_dataset = {}
 
     for theorytab_id, theorytab in theorytab_dataset.items():
         if not has_valid_tags(theorytab):
             continue
 
-        keep_theorytab = True
-        for chord in theorytab['chords']:
-            if chord['complete_rn'] not in complete_rns:
-                keep_theorytab = False
-                break
-            
-        if keep_theorytab:
-            theorytab_ids_to_keep.add(theorytab_id)
-
-    theorytab_dataset = {
-        theorytab_id: theorytab
-        for theorytab_id, theorytab in theorytab_dataset.items() if theorytab_id in theorytab_ids_to_keep
-    }
-
-    with h5py.File('/storage/datasets/thiago.poppe/TheoryTabDB/segments/labels.h5', 'w') as h5f:
+        chord_rns = {chord['complete_rn'] for chord in theorytab['chords']}
+        if chord_rns.issubset(complete_rns):
+            filtered_theorytab_dataset[theorytab_id] = theorytab
+
+    theorytab_dataset = filtered_theorytab_dataset
+
+    with h5py.File('/storage/datasets/thiago.poppe/TheoryTabDB/segments/labels.h5', 'w', libver='latest') as h5f:
         for theorytab_id, theorytab in tqdm(theorytab_dataset.items()):
             labels = encode_labels(theorytab)
-            labels_segments = view_as_windows(labels, (len(ALL_TASKS), WINDOW_SIZE), (len(ALL_TASKS), STEP_SIZE)).squeeze(0)
+            labels_segments = sliding_window_view(labels, WINDOW_SIZE, axis=1)[:, ::STEP_SIZE].transpose(1, 0, 2)
 
-            for segment_idx, segment in enumerate(labels_segments):
-                h5f.create_dataset(f'{theorytab_id}/{segment_idx}', data=segment, compression='gzip')
+            h5f.create_dataset(theorytab_id, data=labels_segments, chunks=(1, len(ALL_TASKS), WINDOW_SIZE), **COMPRESSION)
 
 
 if __name__ == "__main__":
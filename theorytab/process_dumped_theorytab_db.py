@@ -27,12 +27,17 @@
 import os
 import re
 import h5py
-import json
+import ijson
+import orjson
 import logging
 import traceback
 
 from tqdm import tqdm
-from bs4 import BeautifulSoup
+from bisect import bisect_left, bisect_right
+from functools import partial, lru_cache
+from itertools import chain
+from multiprocessing.pool import Pool
+from lxml import etree
 from os.path import join as ospj
 from argparse import ArgumentParser
 
@@ -43,8 +48,54 @@ FLATS_ACCIDENTALS_ORDER = [6, 2, 5, 1, 4, 0, 3]
 ACCIDENTAL_TO_SCALE_MODE = {'b': 'minor', '0': 'major', '-2': 'dorian', '-4': 'phrygian', 
                             '1': 'lydian', '-1': 'mixolydian', '-3': 'minor', '-5': 'locrian'}
 
+# Mapping xmlData chord symbols to the JSON chord fields (figured bass 42 is a seventh chord, anything else is a triad)
+CHORD_INFO_MAPPER = {
+    'type': {
+        '7': 7,
+        '9': 9,
+        '11': 11,
+        '42': 7
+    },
+    'inversion': {
+        '6': 1,
+        '64': 2,
+        '65': 1,
+        '43': 2,
+        '42': 3
+    },
+    'sus': {
+        'sus2': [2],
+        'sus4': [4],
+        'sus42': [2, 4]
+    },
+    'adds': {
+        'add9': [9]
+    },
+    'alterations': {
+        '#5': ['#5'],
+        'b5': ['b5']
+    }
+}
+
 DUMPED_DB_FILEPATH = '/storage/datasets/thiago.poppe/TheoryTabDB/theorytab_db_dump.json'
 PROCESSED_DB_FILEPATH = '/storage/datasets/thiago.poppe/TheoryTabDB/processed_theorytab_db.json'
+TEMPORARY_PROCESSED_DB_FILEPATH = PROCESSED_DB_FILEPATH + '.tmp'
+
+# Recovering from malformed documents, just like BeautifulSoup does
+XML_PARSER = etree.XMLParser(recover=True)
+SEGMENTS_XPATH = etree.XPath('.//segment')
+NOTES_XPATH = etree.XPath('.//note')
+CHORDS_XPATH = etree.XPath('.//chord')
+
+METADATA_TAGS = ('artist', 'song', 'section', 'dateModified', 'songURL', 'artistURL', 'sectionURL')
+METADATA_XPATH = etree.XPath(f"//*[{' or '.join(f'self::{tag}' for tag in METADATA_TAGS)}][not(ancestor::xmlData)]")
+
+YOUTUBE_URL_REGEX = re.compile(
+    r'(?:https?:\/\/)?(?:(?:www|m|music)\.)?'
+    r'(?:youtube(?:-nocookie)?\.com\/(?:[^\/\n\s]+\/\S*?v=|embed\/|v\/|e\/|shorts\/|live\/|watch\?(?:\S*?&)?v=)|youtu\.be\/)'
+    r'([a-zA-Z0-9_-]{11})'
+)
+YOUTUBE_ID_REGEX = re.compile(r'^[a-zA-Z0-9_-]{11}$')
 
 logging.basicConfig(
     level=logging.INFO,
@@ -54,9 +105,56 @@ logging.basicConfig(
 
 logging.info('Loading theorytab ids with audio, this may take a while...')
 with h5py.File(AUDIOS_FILEPATH, 'r') as h5f:
-    theorytab_ids_with_audio = list(h5f.keys())
+    theorytab_ids_with_audio = frozenset(h5f.keys())
+
+
+def find_string(element, tag: str):
+    '''
+    Method to get the text of the first descendant of an element with a given tag.
+
+    Arguments
+    ---------
+        - element (etree.Element): element to search in.
+        - tag (str): tag of the descendant.
+
+    Return
+    ------
+        - The text of the descendant, or None if it doesn't exist or is empty (same as BeautifulSoup's tag.string).
+    '''
+    descendant = element.find(f'.//{tag}')
+    return None if descendant is None else descendant.text
+
+
+def retrieve_metadata(document):
+    '''
+    Method to get the text of every metadata tag of a payload, ignoring the (unescaped) contents of xmlData.
+
+    Arguments
+    ---------
+        - document (etree.Element): parsed payload.
+
+    Return
+    ------
+        - A dict mapping each tag in METADATA_TAGS to the text of its first occurrence (None if it doesn't exist or is empty).
+    '''
+    metadata = dict.fromkeys(METADATA_TAGS)
+    found_tags = set()
+
+    for element in METADATA_XPATH(document):
+        if element.tag not in found_tags:
+            metadata[element.tag] = element.text
+            found_tags.add(element.tag)
+
+    return metadata
+
+
+def has_tag_contents(payload: str, tag: str):
+    start = payload.find(f'<{tag}>')
+    end = payload.find(f'</{tag}>', start)
+    return start != -1 and end > start + len(tag) + 2
 
 
+@lru_cache(maxsize=1024)
 def extract_youtube_id(url: str):
     '''
     Method to extract a YouTube's video id based on its URL.
@@ -73,46 +171,37 @@ def extract_youtube_id(url: str):
     -----
         1. First, this method tries to match the URL to a YouTube URL regex in order to return its URL.
         2. If no match was found, then the method checks if the URL is already an ID, if so return it.
+        3. Results are cached, since the same URL is shared by every section of a song.
     '''
     if url is None:
         return None
     
-    url_regex = r'(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/(?:[^\/\n\s]+\/\S*?v=|embed\/|v\/|watch\?v=)|youtu\.be\/)([a-zA-Z0-9_-]{11})'
-    
     # First try to match a YouTube URL
-    url_match = re.search(url_regex, url)
+    url_match = YOUTUBE_URL_REGEX.search(url)
     if url_match:
         return url_match.group(1) 
         
     # If no URL match, check if it's a YouTube video ID directly
-    id_regex = r'^[a-zA-Z0-9_-]{11}$'
-    id_match = re.match(id_regex, url)
+    id_match = YOUTUBE_ID_REGEX.match(url)
     if id_match:
         return url
     
     return None  # Neither a URL nor an ID
 
 
-def get_borrowed_scale(borrowed: str):
+def compute_borrowed_scale(borrowed: int):
     '''
-    Method to get a borrowed scale name or intervals.
+    Method to compute a borrowed scale template by adding flats or sharps to a major scale.
 
     Arguments
     ---------
-        - borrowed (str): the borrowed information stored inside a borrowed tag.
+        - borrowed (int): number of flats (if negative) or sharps (if positive) to add.
 
     Return
     ------
-        - A string representing the borrowed scale name, e.g. mixolydian, or the scale template (list with 7 elements).
+        - The scale template (tuple with 7 elements).
     '''
-    if borrowed is None:
-        return None
-    
-    if borrowed in ACCIDENTAL_TO_SCALE_MODE:
-        return ACCIDENTAL_TO_SCALE_MODE[borrowed]
-    
-    # If int(borrowed) < 0, then we are adding flats (factor = -1); otherwise, sharps (factor = 1)
-    borrowed = int(borrowed)
+    # If borrowed < 0, then we are adding flats (factor = -1); otherwise, sharps (factor = 1)
     factor = -1 if borrowed < 0 else 1
     accidentals_order = FLATS_ACCIDENTALS_ORDER if borrowed < 0 else SHARP_ACCIDENTALS_ORDER
 
@@ -122,94 +211,102 @@ def get_borrowed_scale(borrowed: str):
         idx = accidentals_order[i % 7]
         borrowed_scale[idx] += factor
 
-    return borrowed_scale
+    return tuple(borrowed_scale)
 
 
-def process_json(soup):
-    processed_data = {}
-    payload = json.loads(soup.find('jsonData').string)
+BORROWED_SCALES = {str(borrowed): compute_borrowed_scale(borrowed) for borrowed in range(-14, 15)}
+BORROWED_SCALES.update(ACCIDENTAL_TO_SCALE_MODE)
 
-    # Retrieving number of beats information
-    num_beats = payload['keyFrames'][-1]['beat'] - 1
-    processed_data['num_beats'] = num_beats
 
-    # Retrieving youtube id information
-    youtube_id = extract_youtube_id(soup.find('youTubeID').string)
+@lru_cache(maxsize=None)
+def get_borrowed_scale(borrowed: str):
+    '''
+    Method to get a borrowed scale name or intervals.
 
-    if youtube_id is None:
-        youtube_id = extract_youtube_id(payload['youtube']['id'])
+    Arguments
+    ---------
+        - borrowed (str): the borrowed information stored inside a borrowed tag.
 
-    processed_data['youtube'] = {
-        'id': youtube_id,
-        'start_sync': payload['youtube']['syncStart'],
-        'end_sync': payload['youtube']['syncEnd']
-    }
+    Return
+    ------
+        - A string representing the borrowed scale name, e.g. mixolydian, or the scale template (tuple with 7 elements).
+          Both are immutable, so the (cached) result can be shared between chords.
+    '''
+    if borrowed is None:
+        return None
+    
+    if borrowed in BORROWED_SCALES:
+        return BORROWED_SCALES[borrowed]
 
-    notes = []
-    for melody_voice in payload['inactiveNotes']:
-        for note in melody_voice:
-            if note.get('beat') is None or note.get('duration') is None:
-                continue
+    return compute_borrowed_scale(int(borrowed))
 
-            onset = max(0, note['beat'] - 1)
-            if onset >= num_beats:
-                continue
 
-            offset = min(num_beats, onset + note['duration'])
+def build_notes(raw_notes, num_beats: int):
+    '''
+    Method to build the notes of a JSON payload, skipping rests and notes outside the theorytab.
 
-            if note.get('isRest') or note['sd'] == 'rest':
-                continue
+    Arguments
+    ---------
+        - raw_notes (iterable): notes as stored in the JSON payload.
+        - num_beats (int): number of beats of the theorytab, used to clip the notes.
 
-            notes.append({
-                'sd': note['sd'],
-                'octave': note['octave'],
-                'onset': onset,
-                'offset': offset,
-                # 'is_rest': note.get('isRest', note['sd'] == 'rest')
-            })
+    Return
+    ------
+        - A list with the processed notes.
+    '''
+    notes = []
+    for note in raw_notes:
+        beat = note.get('beat')
+        duration = note.get('duration')
+        if beat is None or duration is None:
+            continue
 
-    if len(notes) == 0:  # just to be certain in case that inactiveNotes doesn't have anything
-        for note in payload['notes']:
-            if note.get('beat') is None or note.get('duration') is None:
-                continue
+        onset = max(0, beat - 1)
+        if onset >= num_beats or note.get('isRest') or note['sd'] == 'rest':
+            continue
 
-            onset = max(0, note['beat'] - 1)
-            if onset >= num_beats:
-                continue
+        notes.append({
+            'sd': note['sd'],
+            'octave': note['octave'],
+            'onset': onset,
+            'offset': min(num_beats, onset + duration),
+            # 'is_rest': note.get('isRest', note['sd'] == 'rest')
+        })
 
-            offset = min(num_beats, onset + note['duration'])
+    return notes
 
-            if note.get('isRest') or note['sd'] == 'rest':
-                continue
 
-            notes.append({
-                'sd': note['sd'],
-                'octave': note['octave'],
-                'onset': onset,
-                'offset': offset,
-                # 'is_rest': note.get('isRest', note['sd'] == 'rest')
-            })
-            
-    # Retrieving chords
+def build_chords(raw_chords, num_beats: int):
+    '''
+    Method to build the chords of a JSON payload, skipping rests and chords outside the theorytab.
+
+    Arguments
+    ---------
+        - raw_chords (iterable): chords as stored in the JSON payload.
+        - num_beats (int): number of beats of the theorytab, used to clip the chords.
+
+    Return
+    ------
+        - A list with the processed chords.
+    '''
     chords = []
-    for chord in payload['chords']:
+    for chord in raw_chords:
         onset = max(0, chord['beat'] - 1)
         if onset >= num_beats:
             continue
 
-        offset = min(num_beats, onset + chord['duration'])
+        root = chord['root']
+        if root == 'rest' or root == 0 or chord.get('isRest'):
+            continue
 
         borrowed = chord['borrowed']
         if borrowed == 'super:2':
             borrowed = [1, 2, 4, 6, 7, 9, 11]
 
-        if chord['root'] == 'rest' or chord['root'] == 0 or chord.get('isRest'):
-            continue
-
         chords.append({
-            'root': chord['root'],
+            'root': root,
             'onset': onset,
-            'offset': offset,
+            'offset': min(num_beats, onset + chord['duration']),
             'type': chord['type'],
             'inversion': chord['inversion'],
             'applied': chord['applied'],
@@ -222,6 +319,39 @@ def process_json(soup):
             # 'is_rest': chord.get('isRest', chord['root'] == 'rest')
         })
 
+    return chords
+
+
+def process_json(document):
+    processed_data = {}
+    metadata = retrieve_metadata(document)
+    payload = orjson.loads(find_string(document, 'jsonData'))
+
+    # Retrieving number of beats information
+    num_beats = payload['keyFrames'][-1]['beat'] - 1
+    processed_data['num_beats'] = num_beats
+
+    # Retrieving youtube id information
+    youtube_id = extract_youtube_id(find_string(document, 'youTubeID'))
+
+    if youtube_id is None:
+        youtube_id = extract_youtube_id(payload['youtube']['id'])
+
+    processed_data['youtube'] = {
+        'id': youtube_id,
+        'start_sync': payload['youtube']['syncStart'],
+        'end_sync': payload['youtube']['syncEnd']
+    }
+
+    # Retrieving notes from every melody voice
+    notes = build_notes(chain.from_iterable(payload['inactiveNotes']), num_beats)
+
+    if len(notes) == 0:  # just to be certain in case that inactiveNotes doesn't have anything
+        notes = build_notes(payload['notes'], num_beats)
+
+    # Retrieving chords
+    chords = build_chords(payload['chords'], num_beats)
+
     # Retrieving keys
     keys = []
     for i in range(len(payload['keys']) - 1):
@@ -243,37 +373,26 @@ def process_json(soup):
         'tonic': last_key['tonic']
     })
 
-    # Correcting chords and notes that are splitted by two keys
+    # Correcting chords and notes that are splitted by two keys (or more)
+    key_offsets = sorted({key['offset'] for key in keys})
+
     def split_objects(objs):
-        def get_key_split(onset, offset):
-            for key in keys:
-                if key['offset'] > onset and key['offset'] < offset:
-                    return key
-                
-            return None
-        
         final_objs = []
-        has_split = False
 
         for obj in objs:
-            key_split = get_key_split(obj['onset'], obj['offset'])
+            # Key offsets strictly inside (onset, offset) are the split points of the object
+            first_split = bisect_right(key_offsets, obj['onset'])
+            last_split = bisect_left(key_offsets, obj['offset'])
 
-            if key_split:
-                has_split = True
-                first_part = obj.copy()
-                first_part['offset'] = key_split['offset']
+            onset = obj['onset']
+            for split_offset in key_offsets[first_split:last_split]:
+                final_objs.append(dict(obj, onset=onset, offset=split_offset))
+                onset = split_offset
 
-                second_part = obj.copy()
-                second_part['onset'] = key_split['offset']    
-            
-                final_objs.append(first_part)
-                final_objs.append(second_part)
-            else:
-                final_objs.append(obj)
+            # The last part (or the whole object if there is no split) reuses the object itself
+            obj['onset'] = onset
+            final_objs.append(obj)
 
-        if has_split:
-            return split_objects(final_objs)
-        
         return final_objs
 
     final_notes = split_objects(notes)
@@ -329,60 +448,63 @@ def process_json(soup):
     processed_data['tempos'] = tempos
     processed_data['meters'] = meters
 
-    return processed_data
+    return processed_data, metadata
 
 
-def process_xml(soup):
+def process_xml(document):
     processed_data = {}
-    payload = soup.find('xmlData')
+    metadata = retrieve_metadata(document)
+    payload = document.find('.//xmlData')
 
     # Retrieving youtube id information
-    youtube_id = extract_youtube_id(soup.find('youTubeID').string)
+    youtube_id = extract_youtube_id(find_string(document, 'youTubeID'))
 
     if youtube_id is None:
-        youtube_id = extract_youtube_id(payload.find('YouTubeID').string)
+        youtube_id = extract_youtube_id(find_string(payload, 'YouTubeID'))
 
     # Grabbing relevant overall meta information
-    meta = payload.find('meta')
-    key = meta.find('key').string
+    meta = payload.find('.//meta')
+    key = find_string(meta, 'key')
     mode_names = ['major', 'dorian', 'phrygian', 'lydian', 'mixolydian', 'minor', 'locrian']
-    mode = 'major' if meta.mode is None else mode_names[int(meta.mode.string) - 1]
+    mode = 'major' if meta.find('.//mode') is None else mode_names[int(find_string(meta, 'mode')) - 1]
 
-    bpm = None if meta.BPM is None else int(meta.BPM.string)
-    beats_in_measure = int(meta.find('beats_in_measure').string)
+    bpm = None if meta.find('.//BPM') is None else int(find_string(meta, 'BPM'))
+    beats_in_measure = int(find_string(meta, 'beats_in_measure'))
 
-    if payload.find('sections'):  # checking if filter by section is required
-        num_sections = len(payload.find('sections').findChildren(recursive=False))
+    sections = payload.find('.//sections')
+    if sections is not None:  # checking if filter by section is required
+        num_sections = len(sections.findall('*'))
 
         if num_sections > 1:
-            section_name = soup.find('section').string
-            section_info = payload.find_all(section_name)
+            section_name = find_string(document, 'section')
+            section_info = list(payload.iter(section_name))
 
             if len(section_info) == 0:
                 logging.warning(f'Section {section_name} not found for xmlData.')
-                return None
+                return None, metadata
 
             meta, payload = section_info
 
     # Retrieving number of beats information
     num_beats_per_segment = []
 
-    for segment in payload.find_all('segment'):
-        if segment.find('numBeats'):
-            num_beats_per_segment.append(int(segment.find('numBeats').string))
-        elif segment.find('numMeasures'):
-            num_beats_per_segment.append(beats_in_measure * int(segment.find('numMeasures').string))
+    segments = SEGMENTS_XPATH(payload)
+    for segment in segments:
+        if segment.find('.//numBeats') is not None:
+            num_beats_per_segment.append(int(find_string(segment, 'numBeats')))
+        elif segment.find('.//numMeasures') is not None:
+            num_beats_per_segment.append(beats_in_measure * int(find_string(segment, 'numMeasures')))
         else:
             logging.error("Couldn't find neither numBeats nor numMeasures!")
-            return None
+            return None, metadata
 
     num_beats = sum(num_beats_per_segment)
     processed_data['num_beats'] = num_beats
 
     # Retrieving youtube information
-    global_start = float(meta.find('global_start').string)
-    active_start = float(meta.find('active_start').string)
-    active_stop = float(meta.find('active_stop').string)
+    global_start = float(find_string(meta, 'global_start'))
+    active_start = float(find_string(meta, 'active_start'))
+    active_stop = float(find_string(meta, 'active_stop'))
 
     processed_data['youtube'] = {
         'id': youtube_id,
@@ -390,92 +512,55 @@ def process_xml(soup):
         'end_sync': global_start + active_stop
     }
 
-    # Retrieving notes
+    # Retrieving notes and chords
     notes = []
+    chords = []
     global_onset = 0.0
-    for segment_idx, segment in enumerate(payload.find_all('segment')):
-        for note in segment.find_all('note'):
-            start_measure = int(note.start_measure.string)
-            start_beat = float(note.start_beat.string)
+    for segment_idx, segment in enumerate(segments):
+        for note in NOTES_XPATH(segment):
+            start_measure = int(find_string(note, 'start_measure'))
+            start_beat = float(find_string(note, 'start_beat'))
 
             onset = global_onset + beats_in_measure * (start_measure - 1) + (start_beat - 1)
-            offset = onset + float(note.note_length.string)
+            offset = onset + float(find_string(note, 'note_length'))
 
             is_rest = False
-            if note.isRest is not None and note.isRest.string == '1':
+            if note.find('.//isRest') is not None and find_string(note, 'isRest') == '1':
                 is_rest = True
-            elif note.isRest is None and note.scale_degree.string == 'rest':
+            elif note.find('.//isRest') is None and find_string(note, 'scale_degree') == 'rest':
                 is_rest = True
 
             if is_rest:
                 continue
 
             notes.append({
-                'sd': note.scale_degree.string,
-                'octave': int(note.octave.string),
+                'sd': find_string(note, 'scale_degree'),
+                'octave': int(find_string(note, 'octave')),
                 'onset': onset,
                 'offset': offset,
                 # 'is_rest': is_rest
             })
 
-        global_onset += num_beats_per_segment[segment_idx]
-
-    # Retrieving chords
-    chord_info_mapper = {
-        'type': {
-            '7': 7,
-            '9': 9,
-            '11': 11
-        },
-        'inversion': {
-            '6': 1,
-            '64': 2,
-            '65': 1,
-            '43': 2,
-            '42': 3
-        },
-        'sus': {
-            'sus2': [2],
-            'sus4': [4],
-            'sus42': [2, 4]
-        },
-        'adds': {
-            'add9': [9]
-        },
-        'alterations': {
-            '#5': ['#5'],
-            'b5': ['b5']
-        }
-    }
-
-    chords = []
-    global_onset = 0.0
-    for segment_idx, segment in enumerate(payload.find_all('segment')):
-        for chord in segment.find_all('chord'):
-            root = chord.sd.string
-            applied = chord.sec.string
+        for chord in CHORDS_XPATH(segment):
+            root = find_string(chord, 'sd')
+            applied = find_string(chord, 'sec')
 
             if applied:  # to be consistent with the JSON data
                 root, applied = applied, root
 
-            start_measure = int(chord.start_measure.string)
-            start_beat = float(chord.start_beat.string)
+            start_measure = int(find_string(chord, 'start_measure'))
+            start_beat = float(find_string(chord, 'start_beat'))
 
             onset = global_onset + beats_in_measure * (start_measure - 1) + (start_beat - 1)
-            offset = onset + float(chord.chord_duration.string)
-
-            adds = []
-            if chord.emb is not None:
-                adds = chord_info_mapper['adds'].get(chord.emb.string, [])
+            offset = onset + float(find_string(chord, 'chord_duration'))
 
-            alterations = []
-            if chord.emb is not None:
-                alterations = chord_info_mapper['alterations'].get(chord.emb.string, [])
+            fb = find_string(chord, 'fb')
+            emb = find_string(chord, 'emb')
 
             is_rest = False
-            if chord.isRest is not None and chord.isRest.string == '1':
+            if chord.find('.//isRest') is not None and find_string(chord, 'isRest') == '1':
                 is_rest = True
-            elif chord.isRest is None and chord.sd.string == 'rest':
+            elif chord.find('.//isRest') is None and find_string(chord, 'sd') == 'rest':
                 is_rest = True
             elif root == 'rest' or (root.isdigit() and int(root) == 0):
                 is_rest = True
@@ -487,15 +572,15 @@ def process_xml(soup):
                 'root': int(root),
                 'onset': onset,
                 'offset': offset,
-                'type': chord_info_mapper['type'].get(chord.fb.string, 7 if chord.fb.string == '42' else 5),
-                'inversion': chord_info_mapper['inversion'].get(chord.fb.string, 0),
+                'type': CHORD_INFO_MAPPER['type'].get(fb, 5),
+                'inversion': CHORD_INFO_MAPPER['inversion'].get(fb, 0),
                 'applied': int(applied) if applied is not None else 0,
-                'adds': adds,
+                'adds': CHORD_INFO_MAPPER['adds'].get(emb, []),
                 'omits': [],
-                'alterations': alterations,
-                'suspensions': chord_info_mapper['sus'].get(chord.sus.string, []),
+                'alterations': CHORD_INFO_MAPPER['alterations'].get(emb, []),
+                'suspensions': CHORD_INFO_MAPPER['sus'].get(find_string(chord, 'sus'), []),
                 'substitutions': [],
-                'borrowed': get_borrowed_scale(chord.borrowed.string),
+                'borrowed': get_borrowed_scale(find_string(chord, 'borrowed')),
                 # 'is_rest': is_rest
             })
 
@@ -532,7 +617,7 @@ def process_xml(soup):
     processed_data['tempos'] = tempos
     processed_data['meters'] = meters
 
-    return processed_data
+    return processed_data, metadata
 
 
 def retrieve_theorytab_tags(theorytab_id, theorytab):
@@ -556,104 +641,132 @@ def retrieve_theorytab_tags(theorytab_id, theorytab):
     if len(theorytab['tempos']) > 1:
         tags.append('HAS_TEMPO_CHANGE')
 
-    has_swing_tempo = any([tempo['swing_factor'] != 0 for tempo in theorytab['tempos']])
+    has_swing_tempo = any(tempo['swing_factor'] != 0 for tempo in theorytab['tempos'])
     if has_swing_tempo:
         tags.append('HAS_SWING_TEMPO')
 
-    is_all_4x4 = all([meter['beats_in_measure'] == 4 and meter['beat_unit'] == 1 for meter in theorytab['meters']])
+    is_all_4x4 = all(meter['beats_in_measure'] == 4 and meter['beat_unit'] == 1 for meter in theorytab['meters'])
     if is_all_4x4:
         tags.append('ONLY_COMMON_TIME')
 
-    is_majmin_theorytab = True
-    for key in theorytab['keys']:
-        if key['scale'] not in ('major', 'minor'):
-            is_majmin_theorytab = False
-            break
-    
+    is_majmin_theorytab = all(key['scale'] in ('major', 'minor') for key in theorytab['keys'])
     if is_majmin_theorytab:
         tags.append('ONLY_MAJMIN_KEYS')
 
     return tags
 
 
+def process_entry(entry, min_bpm: int, max_bpm: int):
+    '''
+    Method to process a single entry of the dumped database.
+
+    Arguments
+    ---------
+        - entry (dict): dumped database entry, mapping a theorytab id to its crawled data.
+        - min_bpm (int): minimum BPM value to filter slow songs.
+        - max_bpm (int): maximum BPM value to filter fast songs.
+
+    Return
+    ------
+        - A tuple with the theorytab id and its processed data, which is None if the entry was skipped.
+    '''
+    theorytab_id = list(entry.keys())[0]
+
+    try:
+        data = list(entry.values())[0]
+        payload = data['payload']
+
+        processed_data = None
+        if has_tag_contents(payload, 'xmlData'):
+            document = etree.fromstring(payload.replace('&lt;', '<').replace('&gt;', '>').encode(), XML_PARSER)
+            processed_data, metadata = process_xml(document)
+
+        elif has_tag_contents(payload, 'jsonData'):
+            document = etree.fromstring(payload.encode(), XML_PARSER)
+            processed_data, metadata = process_json(document)
+
+        if processed_data is None:
+            logging.error(f'Skipping {theorytab_id} due to insufficient data!')
+            return theorytab_id, None
+
+        has_malformed_root = False
+        for chord in processed_data['chords']:
+            if isinstance(chord['root'], str) or (chord['root'] < 1 or chord['root'] > 7):
+                logging.warning(f"Skipping {theorytab_id} due to malformed {chord['root'] = }")
+                has_malformed_root = True
+                break
+
+        has_unwanted_tempo = False
+        for tempo in processed_data['tempos']:
+            if tempo['bpm'] is None:
+                logging.warning(f"Skipping {theorytab_id} due to None BPM")
+                has_unwanted_tempo = True
+                break
+
+            if tempo['bpm'] < min_bpm or tempo['bpm'] > max_bpm:
+                logging.warning(f"Skipping {theorytab_id} due to out of range {tempo['bpm'] = } with {min_bpm = } and {max_bpm = }")
+                has_unwanted_tempo = True
+                break
+
+        if has_malformed_root or has_unwanted_tempo:
+            return theorytab_id, None
+
+        processed_data['hooktheory'] = {
+            'genres': data['genres'],
+            'annotators': data['contributors'],
+            'song_metrics': data['song_metrics'],
+            'artist': metadata['artist'],
+            'song': metadata['song'],
+            'section': metadata['section'],
+            'modified_date': metadata['dateModified'],
+            'hooktheory_api': f'https://api.hooktheory.com/v1/songs/public/{theorytab_id}',
+            'theorytab_url': f"https://www.hooktheory.com/theorytab/view/{metadata['artistURL']}/{metadata['songURL']}#{metadata['sectionURL']}"
+        }
+
+        processed_data['tags'] = retrieve_theorytab_tags(theorytab_id, processed_data)
+        return theorytab_id, processed_data
+
+    except Exception as e:
+        print(traceback.format_exc())
+        logging.error(f'Exception for {theorytab_id = }')
+        raise
+
+
 def main(args):
-    with open(DUMPED_DB_FILEPATH, 'r') as fp:
-        dumped_database = json.load(fp)
-    
-    processed_dataset = {}
-    for entry in tqdm(dumped_database):
-        try:
-            data = list(entry.values())[0]
-            theorytab_id = list(entry.keys())[0]
-            soup = BeautifulSoup(data['payload'], 'xml')
-
-            processed_data = None
-            if soup.find('xmlData') and len(soup.find('xmlData').contents) > 0:
-                xml_soup = BeautifulSoup(data['payload'].replace('&lt;', '<').replace('&gt;', '>'), 'xml')
-                processed_data = process_xml(xml_soup)
-
-            elif soup.find('jsonData') and len(soup.find('jsonData').contents) > 0:
-                processed_data = process_json(soup)
-
-            if processed_data is None:
-                logging.error(f'Skipping {theorytab_id} due to insufficient data!')
-                continue
+    processed_dataset_size = 0
+    process_fn = partial(process_entry, min_bpm=args.min_bpm, max_bpm=args.max_bpm)
 
-            has_malformed_root = False
-            for chord in processed_data['chords']:
-                if isinstance(chord['root'], str) or (chord['root'] < 1 or chord['root'] > 7):
-                    logging.warning(f"Skipping {theorytab_id} due to malformed {chord['root'] = }")
-                    has_malformed_root = True
-                    break
-
-            has_unwanted_tempo = False
-            for tempo in processed_data['tempos']:
-                if tempo['bpm'] is None:
-                    logging.warning(f"Skipping {theorytab_id} due to None BPM")
-                    has_unwanted_tempo = True
-                    break
-
-                if tempo['bpm'] < args.min_bpm or tempo['bpm'] > args.max_bpm:
-                    logging.warning(f"Skipping {theorytab_id} due to out of range {tempo['bpm'] = } with {args.min_bpm = } and {args.max_bpm = }")
-                    has_unwanted_tempo = True
-                    break
-
-            if has_malformed_root or has_unwanted_tempo:
-                continue
+    try:
+        with open(DUMPED_DB_FILEPATH, 'rb') as dumped_fp, open(TEMPORARY_PROCESSED_DB_FILEPATH, 'wb') as processed_fp, Pool(args.num_workers) as pool:
+            dumped_database = ijson.items(dumped_fp, 'item', use_float=True)
+
+            processed_fp.write(b'{')
+
+            for theorytab_id, processed_data in tqdm(pool.imap(process_fn, dumped_database, chunksize=64)):
+                if processed_data is None:
+                    continue
 
-            song_url = soup.find('songURL').string
-            artist_url = soup.find('artistURL').string
-            section_url = soup.find('sectionURL').string
+                processed_fp.write(b',\n' if processed_dataset_size > 0 else b'\n')
+                processed_fp.write(orjson.dumps(theorytab_id) + b': ' + orjson.dumps(processed_data))
+                processed_dataset_size += 1
 
-            processed_data['hooktheory'] = {
-                'genres': data['genres'],
-                'annotators': data['contributors'],
-                'song_metrics': data['song_metrics'],
-                'artist': soup.find('artist').string,
-                'song': soup.find('song').string,
-                'section': soup.find('section').string,
-                'modified_date': soup.find('dateModified').string,
-                'hooktheory_api': f'https://api.hooktheory.com/v1/songs/public/{theorytab_id}',
-                'theorytab_url': f'https://www.hooktheory.com/theorytab/view/{artist_url}/{song_url}#{section_url}'
-            }
+            processed_fp.write(b'\n}\n')
 
-            processed_data['tags'] = retrieve_theorytab_tags(theorytab_id, processed_data)
-            processed_dataset[theorytab_id] = processed_data
+    except Exception:
+        if os.path.exists(TEMPORARY_PROCESSED_DB_FILEPATH):
+            os.remove(TEMPORARY_PROCESSED_DB_FILEPATH)
 
-        except Exception as e:
-            print(traceback.format_exc())
-            logging.error(f'Exception for {theorytab_id = }')
-            exit(1)
+        raise
 
-    logging.info(f'Size of processed dataset: {len(processed_dataset)} theorytab ids')
-    with open(PROCESSED_DB_FILEPATH, 'w') as fp:
-        json.dump(processed_dataset, fp, indent=2)
+    os.replace(TEMPORARY_PROCESSED_DB_FILEPATH, PROCESSED_DB_FILEPATH)
+    logging.info(f'Size of processed dataset: {processed_dataset_size} theorytab ids')
 
 
 def parse_command_line_arguments():
     parser = ArgumentParser()
     parser.add_argument('--min_bpm', type=int, default=40, help='Minimum BPM value to filter slow songs.')
     parser.add_argument('--max_bpm', type=int, default=300, help='Maximum BPM value to filter fast songs.')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help='Number of processes used to process the dumped database.')
 
     return parser.parse_args()
 
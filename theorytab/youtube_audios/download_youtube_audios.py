@@ -2,24 +2,28 @@ import sys
 sys.path.append('../..')
 
 import os
-import json
 import time
 import h5py
 import random
+import orjson
 import yt_dlp
+import subprocess
 import librosa
 import logging
 import requests
+import numpy as np
 
 from stem import Signal
 from stem.control import Controller
 
-from source.constants import AUDIOS_FILEPATH, SAMPLING_RATE
+from source.constants import AUDIOS_FILEPATH, SAMPLING_RATE, AUDIO_INT16_SCALE
 
 SLEEP_RANGE = (2.5, 5.5)  # in seconds
 BIG_SLEEP_TIME = 900  # in seconds
 BIG_SLEEP_INTERVAL = 300
 RENEW_TOR_INTERVAL = 75
+AUDIO_CHUNK_SIZE = 1 << 16  # in samples
+YOUTUBE_INFO_FILEPATH = 'youtube_info.jsonl'
 
 logging.basicConfig(
     level=logging.INFO,
@@ -38,12 +42,6 @@ def download_audio(youtube_id: str) -> bool:
     ydl_opts = {
         'format': 'bestaudio/best',
         'outtmpl': youtube_id,
-        'postprocessors': [
-            {
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'wav',
-            }
-        ],
         'quiet': True,
         'proxy': 'socks5://localhost:9150'
     }
@@ -77,14 +75,51 @@ def download_audio(youtube_id: str) -> bool:
     return True, None
 
 
+def decode_audio(filename: str) -> np.ndarray:
+    '''
+    Method to decode an audio file straight into memory using FFmpeg.
+
+    Arguments
+    ---------
+        - filename (str): path of the downloaded audio, in any container supported by FFmpeg.
+
+    Return
+    ------
+        - The mono audio resampled to SAMPLING_RATE, as 16-bit PCM (divide by AUDIO_INT16_SCALE to get float samples).
+
+    Notes
+    -----
+        1. The audio is processed just like librosa.load(filename, sr=SAMPLING_RATE) does, i.e. soxr resampling with
+           librosa's soxr_hq quality (20 bits of precision) and mono as the average of the channels.
+        2. FFmpeg outputs float32 stereo (mono audios are duplicated) and the channels are averaged here, instead of
+           relying on FFmpeg's own downmix matrix.
+    '''
+    command = [
+        'ffmpeg', '-nostdin', '-loglevel', 'error', '-i', filename,
+        '-af', 'aresample=resampler=soxr:precision=20', '-ar', str(SAMPLING_RATE), '-ac', '2',
+        '-f', 'f32le', '-acodec', 'pcm_f32le', 'pipe:1'
+    ]
+
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    audio = np.frombuffer(process.stdout, dtype=np.float32).reshape(-1, 2).mean(axis=1)
+
+    return np.clip(audio * AUDIO_INT16_SCALE, -AUDIO_INT16_SCALE, AUDIO_INT16_SCALE - 1).astype(np.int16)
+
+
 def process_youtube_id(youtube_id, info):
     success_status, err = download_audio(youtube_id)
     if not success_status:
         return [], err
     
-    filename = f'{youtube_id}.wav'
-    audio, sr = librosa.load(filename, sr=SAMPLING_RATE)
-    duration = librosa.get_duration(y=audio, sr=sr)
+    try:
+        audio = decode_audio(youtube_id)
+    except subprocess.CalledProcessError as err:
+        return [], err.stderr.decode() or str(err)
+    finally:
+        os.remove(youtube_id)
+
+    sr = SAMPLING_RATE
+    duration = len(audio) / sr
 
     audios = []
     for alignment in info['alignments']:
@@ -97,59 +132,78 @@ def process_youtube_id(youtube_id, info):
         audio_segment = audio[start_sample:end_sample]
         audios.append((alignment['theorytab_id'], audio_segment))
 
-    os.remove(f'{youtube_id}.wav')
-        
     return audios, None
 
 
+def save_audio(h5f, theorytab_id, audio):
+    # Empty audios (later removed by remove_failed_audios.py) are left for h5py to chunk
+    chunks = (min(len(audio), AUDIO_CHUNK_SIZE),) if len(audio) > 0 else True
+    h5f.create_dataset(theorytab_id, data=audio, dtype='i2', chunks=chunks, compression='lzf')
+
+
+def load_youtube_info():
+    youtube_info = {}
+    with open(YOUTUBE_INFO_FILEPATH, 'rb') as fp:
+        for line in fp:
+            youtube_info.update(orjson.loads(line))
+
+    return youtube_info
+
+
+def save_youtube_info(youtube_info):
+    with open(YOUTUBE_INFO_FILEPATH, 'wb') as fp:
+        for youtube_id, info in youtube_info.items():
+            fp.write(orjson.dumps({youtube_id: info}) + b'\n')
+
+
 def main():
-    if not os.path.exists('youtube_info.json'):
-        logging.error('Please run the script to create youtube_info.json first')
+    if not os.path.exists(YOUTUBE_INFO_FILEPATH):
+        logging.error(f'Please run the script to create {YOUTUBE_INFO_FILEPATH} first')
         sys.exit(1)
 
-    with open('youtube_info.json', 'r') as fp:
-        youtube_info = json.load(fp)
-        youtube_info = dict(sorted(youtube_info.items(), key=lambda p: (p[1]['finished'], len(str(p[1]['error_message']))))[::-1])
+    youtube_info = load_youtube_info()
+    youtube_info = dict(sorted(youtube_info.items(), key=lambda p: (p[1]['finished'], len(str(p[1]['error_message']))))[::-1])
 
-    with h5py.File(AUDIOS_FILEPATH, 'r') as h5f:
+    with h5py.File(AUDIOS_FILEPATH, 'a') as h5f:
         existent_theorytab_ids = set(h5f.keys())
 
-    for idx, (youtube_id, info) in enumerate(youtube_info.items()):
-        if info['finished'] and all([alignment['theorytab_id'] in existent_theorytab_ids for alignment in info['alignments']]):
-            logging.info(f'[{idx+1}/{len(youtube_info)}] {youtube_id} already finished')
-            continue
+        for idx, (youtube_id, info) in enumerate(youtube_info.items()):
+            if info['finished'] and all([alignment['theorytab_id'] in existent_theorytab_ids for alignment in info['alignments']]):
+                logging.info(f'[{idx+1}/{len(youtube_info)}] {youtube_id} already finished')
+                continue
 
-        elif info['error_message']:
-            logging.info(f'[{idx+1}/{len(youtube_info)}] {youtube_id} failed previously with the following error\n{info["error_message"]}')
-            continue
+            elif info['error_message']:
+                logging.info(f'[{idx+1}/{len(youtube_info)}] {youtube_id} failed previously with the following error\n{info["error_message"]}')
+                continue
 
-        audios, err = process_youtube_id(youtube_id, info)
+            audios, err = process_youtube_id(youtube_id, info)
         
-        if err:
-            logging.warning(f'[{idx+1}/{len(youtube_info)}] {youtube_id} failed with the following error\n{err}')
-            youtube_info[youtube_id]['error_message'] = str(err)
-        else:
-            logging.info(f'[{idx+1}/{len(youtube_info)}] {youtube_id} successfully downloaded')
+            if err:
+                logging.warning(f'[{idx+1}/{len(youtube_info)}] {youtube_id} failed with the following error\n{err}')
+                youtube_info[youtube_id]['error_message'] = str(err)
+            else:
+                logging.info(f'[{idx+1}/{len(youtube_info)}] {youtube_id} successfully downloaded')
 
-            with h5py.File(AUDIOS_FILEPATH, 'a') as h5f:
                 for theorytab_id, audio in audios:
                     if theorytab_id not in existent_theorytab_ids:
-                        h5f.create_dataset(theorytab_id, data=audio, compression='gzip')
-                        
-            youtube_info[youtube_id]['finished'] = True
-            with open('youtube_info.json', 'w') as fp:
-                json.dump(youtube_info, fp, indent=2)
+                        save_audio(h5f, theorytab_id, audio)
+                        existent_theorytab_ids.add(theorytab_id)
 
-        if (idx + 1) % BIG_SLEEP_INTERVAL == 0:
-            logging.info('Renewing Tor connection')
-            renew_tor_connection()
+                h5f.flush()
 
-            logging.info(f'Big sleep after seen {idx + 1} YouTube IDs...')
-            time.sleep(BIG_SLEEP_TIME)
+                youtube_info[youtube_id]['finished'] = True
+                save_youtube_info(youtube_info)
 
-        elif (idx + 1) % RENEW_TOR_INTERVAL == 0:
-            logging.info('Renewing Tor connection')
-            renew_tor_connection()
+            if (idx + 1) % BIG_SLEEP_INTERVAL == 0:
+                logging.info('Renewing Tor connection')
+                renew_tor_connection()
+
+                logging.info(f'Big sleep after seen {idx + 1} YouTube IDs...')
+                time.sleep(BIG_SLEEP_TIME)
+
+            elif (idx + 1) % RENEW_TOR_INTERVAL == 0:
+                logging.info('Renewing Tor connection')
+                renew_tor_connection()
             
     logging.info('Job finished!')
 
@@ -2,55 +2,82 @@ import sys
 sys.path.append('../..')
 
 import h5py
-import json
+import ijson
+import orjson
 
-from collections import defaultdict
+from typing import Dict, List, Optional
+from dataclasses import dataclass, field
 from source.utils import has_valid_tags
 from source.constants import AUDIOS_FILEPATH, THEORYTAB_DATASET_FILEPATH
 
+YOUTUBE_INFO_FILEPATH = 'youtube_info.jsonl'
 
-def build_youtube_info(theorytab_dataset, finished_youtube_ids = None):
-    youtube_info = defaultdict(lambda: defaultdict(list))
-    if finished_youtube_ids is None:
-        finished_youtube_ids = set()    
 
-    for theorytab_id, theorytab in theorytab_dataset.items():
+@dataclass(slots=True)
+class Alignment:
+    theorytab_id: str
+    start_sync: float
+    end_sync: float
+
+
+@dataclass(slots=True)
+class YouTubeInfo:
+    error_message: Optional[str] = None
+    finished: bool = False
+    alignments: List[Alignment] = field(default_factory=list)
+
+
+def iterate_theorytab_dataset():
+    with open(THEORYTAB_DATASET_FILEPATH, 'rb') as fp:
+        yield from ijson.kvitems(fp, '', use_float=True)
+
+
+def build_youtube_info(theorytab_items, finished_theorytab_ids = None):
+    youtube_info: Dict[str, YouTubeInfo] = {}
+    finished_youtube_ids = set()
+    if finished_theorytab_ids is None:
+        finished_theorytab_ids = set()    
+
+    for theorytab_id, theorytab in theorytab_items:
+        youtube = theorytab['youtube']
+        youtube_id = youtube['id']
+
+        # Videos are marked as finished in the same pass, even by theorytabs that are skipped below
+        if theorytab_id in finished_theorytab_ids:
+            finished_youtube_ids.add(youtube_id)
+
         if not has_valid_tags(theorytab):
             continue
 
-        youtube_id = theorytab['youtube']['id']
-        start_sync = theorytab['youtube']['start_sync']
-        end_sync = theorytab['youtube']['end_sync']
+        start_sync = youtube['start_sync']
+        end_sync = youtube['end_sync']
         
         if youtube_id is None or start_sync is None or end_sync is None:
             print(f'Invalid YouTube ID or sync times for theorytab {theorytab_id}: {youtube_id}, {start_sync}, {end_sync}')
             continue
         
-        youtube_info[youtube_id]['error_message'] = None 
-        youtube_info[youtube_id]['finished'] = youtube_id in finished_youtube_ids
-        youtube_info[youtube_id]['alignments'].append(
-            {
-                'theorytab_id': theorytab_id,
-                'start_sync': start_sync,
-                'end_sync': end_sync
-            }
-        )
+        info = youtube_info.get(youtube_id)
+        if info is None:
+            info = youtube_info[youtube_id] = YouTubeInfo()
+
+        info.alignments.append(Alignment(theorytab_id, start_sync, end_sync))
+
+    for youtube_id, info in youtube_info.items():
+        info.finished = youtube_id in finished_youtube_ids
 
     return youtube_info
 
 
 if __name__ == '__main__':
-    print('Loading YouTube info from:', THEORYTAB_DATASET_FILEPATH)
-    with open(THEORYTAB_DATASET_FILEPATH, 'r') as fp:
-        dataset = json.load(fp)
-
-    print('Loading finished YouTube IDs from:', AUDIOS_FILEPATH, end='\n\n')
+    print('Loading finished theorytab IDs from:', AUDIOS_FILEPATH)
     with h5py.File(AUDIOS_FILEPATH, 'r') as h5f:
-        finished_theorytab_ids = set(h5f.keys())
-        finished_youtube_ids = {theorytab['youtube']['id'] for theorytab_id, theorytab in dataset.items() if theorytab_id in finished_theorytab_ids}
+        finished_theorytab_ids = set()
+        h5f.id.links.iterate(lambda name: finished_theorytab_ids.add(name.decode()))
     
-    youtube_info = build_youtube_info(dataset, finished_youtube_ids)
+    print('Loading YouTube info from:', THEORYTAB_DATASET_FILEPATH, end='\n\n')
+    youtube_info = build_youtube_info(iterate_theorytab_dataset(), finished_theorytab_ids)
     print('\nTotal number of valid YouTube IDs:', len(youtube_info))
     
-    with open('youtube_info.json', 'w') as fp:
-        json.dump(youtube_info, fp, indent=2)
+    with open(YOUTUBE_INFO_FILEPATH, 'wb') as fp:
+        for youtube_id, info in youtube_info.items():
+            fp.write(orjson.dumps({youtube_id: info}) + b'\n')
@@ -1,12 +1,16 @@
 import sys
 sys.path.append('../..')
 
+import os
 import h5py
 import logging
 
 from tqdm import tqdm
 from source.constants import AUDIOS_FILEPATH
 
+TEMPORARY_AUDIOS_FILEPATH = AUDIOS_FILEPATH + '.tmp'
+METADATA_BLOCK_SIZE = 4 * 1024**2  # in bytes
+
 logging.basicConfig(
     level=logging.INFO,
     format='[%(levelname)s] %(asctime)s - %(message)s',
@@ -14,8 +18,23 @@ logging.basicConfig(
 )
 
 
-with h5py.File(AUDIOS_FILEPATH, 'a') as h5f:
-    for theorytab_id in tqdm(h5f, desc='Cleaning empty audios'):
-        if len(h5f[theorytab_id][:]) == 0:
-            logging.warning(f"Deleting theorytab {theorytab_id} with empty audio")
-            del h5f[theorytab_id]
+with h5py.File(AUDIOS_FILEPATH, 'r') as h5f:
+    theorytab_ids = []
+    h5f.id.links.iterate(theorytab_ids.append)
+
+    empty_theorytab_ids = set()
+
+    for theorytab_id in tqdm(theorytab_ids, desc='Finding empty audios'):
+        if h5py.h5d.open(h5f.id, theorytab_id).get_space().get_simple_extent_npoints() == 0:
+            logging.warning(f"Deleting theorytab {theorytab_id.decode()} with empty audio")
+            empty_theorytab_ids.add(theorytab_id)
+
+if empty_theorytab_ids:
+    with h5py.File(AUDIOS_FILEPATH, 'r') as src_h5f, h5py.File(TEMPORARY_AUDIOS_FILEPATH, 'w', libver='latest', meta_block_size=METADATA_BLOCK_SIZE) as dst_h5f:
+        for theorytab_id in tqdm(theorytab_ids, desc='Copying non-empty audios'):
+            if theorytab_id not in empty_theorytab_ids:
+                h5py.h5o.copy(src_h5f.id, theorytab_id, dst_h5f.id, theorytab_id)
+
+    os.replace(TEMPORARY_AUDIOS_FILEPATH, AUDIOS_FILEPATH)
+else:
+    logging.info('No empty audios found')